@@ -0,0 +1,78 @@
+"""cascade promo code activations on promo delete
+
+Revision ID: 0004_promo_act_fk_cascade
+Revises: 0003_promo_curr_act_not_null
+Create Date: 2026-10-14 00:00:00.000000
+
+"""
+
+from typing import Optional, Sequence, Union
+
+from alembic import op, context
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0004_promo_act_fk_cascade"
+down_revision: Union[str, Sequence[str],
+                     None] = "0003_promo_curr_act_not_null"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+_TABLE_NAME = "promo_code_activations"
+_FK_NAME = "promo_code_activations_promo_code_id_fkey"
+
+
+def _find_promo_code_fk(inspector: sa.Inspector) -> Optional[dict]:
+    for foreign_key in inspector.get_foreign_keys(_TABLE_NAME):
+        if (
+            foreign_key.get("referred_table") == "promo_codes"
+            and foreign_key.get("constrained_columns") == ["promo_code_id"]
+        ):
+            return foreign_key
+    return None
+
+
+def _replace_fk(existing_name: Optional[str], ondelete: Optional[str]) -> None:
+    if existing_name:
+        op.drop_constraint(existing_name, _TABLE_NAME, type_="foreignkey")
+    op.create_foreign_key(
+        _FK_NAME,
+        _TABLE_NAME,
+        "promo_codes",
+        ["promo_code_id"],
+        ["promo_code_id"],
+        ondelete=ondelete,
+    )
+
+
+def upgrade() -> None:
+    if context.is_offline_mode():
+        _replace_fk(_FK_NAME, "CASCADE")
+        return
+
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    if not inspector.has_table(_TABLE_NAME):
+        return
+
+    foreign_key = _find_promo_code_fk(inspector)
+    if foreign_key and (foreign_key.get("options") or {}).get("ondelete", "").upper() == "CASCADE":
+        return
+
+    _replace_fk(foreign_key.get("name") if foreign_key else None, "CASCADE")
+
+
+def downgrade() -> None:
+    if context.is_offline_mode():
+        _replace_fk(_FK_NAME, None)
+        return
+
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    if not inspector.has_table(_TABLE_NAME):
+        return
+
+    foreign_key = _find_promo_code_fk(inspector)
+    _replace_fk(foreign_key.get("name") if foreign_key else None, None)
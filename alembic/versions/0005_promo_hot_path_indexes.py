@@ -0,0 +1,77 @@
+"""add indexes for promo and discount hot paths
+
+Revision ID: 0005_promo_hot_path_indexes
+Revises: 0004_promo_act_fk_cascade
+Create Date: 2026-10-15 00:00:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op, context
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0005_promo_hot_path_indexes"
+down_revision: Union[str, Sequence[str],
+                     None] = "0004_promo_act_fk_cascade"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# promo_codes(code), promo_code_activations(promo_code_id, user_id) and
+# active_discounts(user_id) are already unique via constraints / primary key.
+_INDEXES = (
+    # (index name, table, columns, partial predicate)
+    ("idx_promo_codes_active_created_at", "promo_codes", ["created_at"],
+     sa.text("is_active")),
+    ("idx_active_discounts_promo_code_id", "active_discounts", ["promo_code_id"],
+     None),
+    ("idx_payments_promo_code_id", "payments", ["promo_code_id"], None),
+)
+
+
+def _create_index(name: str, table: str, columns: list,
+                  where: Union[sa.TextClause, None]) -> None:
+    op.create_index(
+        name,
+        table,
+        columns,
+        unique=False,
+        postgresql_where=where,
+    )
+
+
+def upgrade() -> None:
+    if context.is_offline_mode():
+        for name, table, columns, where in _INDEXES:
+            _create_index(name, table, columns, where)
+        return
+
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+
+    for name, table, columns, where in _INDEXES:
+        if not inspector.has_table(table):
+            continue
+        indexes = {index["name"] for index in inspector.get_indexes(table)}
+        if name not in indexes:
+            _create_index(name, table, columns, where)
+
+
+def downgrade() -> None:
+    if context.is_offline_mode():
+        for name, table, _columns, _where in _INDEXES:
+            op.drop_index(name, table_name=table)
+        return
+
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+
+    for name, table, _columns, _where in _INDEXES:
+        if not inspector.has_table(table):
+            continue
+        indexes = {index["name"] for index in inspector.get_indexes(table)}
+        if name in indexes:
+            op.drop_index(name, table_name=table)
@@ -119,7 +119,7 @@ async def promo_management_handler(callback: types.CallbackQuery, i18n_data: dic
     offset = page * page_size
     
     # Получаем общее количество промокодов
-    total_count = await promo_code_dal.get_promo_codes_count(session)
+    total_count = await promo_code_dal.get_promo_codes_count_estimate(session)
     total_pages = (total_count + page_size - 1) // page_size if total_count > 0 else 1
     
     promo_models = await promo_code_dal.get_all_promo_codes_with_details(session, limit=page_size, offset=offset)
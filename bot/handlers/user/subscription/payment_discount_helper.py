@@ -5,7 +5,6 @@ Helper функция для применения скидок к платежа
 import logging
 from typing import Optional, Tuple
 from sqlalchemy.ext.asyncio import AsyncSession
-from db.dal import active_discount_dal
 
 
 async def apply_discount_to_payment(
@@ -23,9 +22,14 @@ async def apply_discount_to_payment(
     if not promo_code_service:
         return original_price, None, None
 
-    active_discount = await active_discount_dal.get_active_discount(session, user_id)
-    if not active_discount:
+    from db.dal import active_discount_dal
+
+    discount_with_promo = await active_discount_dal.get_active_discount_with_promo(
+        session, user_id
+    )
+    if not discount_with_promo:
         return original_price, None, None
+    active_discount, promo = discount_with_promo
 
     # Calculate discounted price
     final_price, discount_amount = promo_code_service.calculate_discounted_price(
@@ -33,7 +37,7 @@ async def apply_discount_to_payment(
     )
 
     logging.info(
-        f"Applying {active_discount.discount_percentage}% discount to payment for user {user_id}: "
+        f"Applying {active_discount.discount_percentage}% discount ({promo.code}) to payment for user {user_id}: "
         f"{original_price} -> {final_price}"
     )
 
@@ -38,6 +38,7 @@ from bot.services.crypto_pay_service import CryptoPayService, cryptopay_webhook_
 from bot.handlers.user import payment as user_payment_webhook_module
 from bot.handlers.admin.sync_admin import perform_sync
 from bot.utils.message_queue import init_queue_manager
+from bot.utils.config_link import close_crypt4_panel_service
 
 
 async def register_all_routers(dp: Dispatcher, settings: Settings):
@@ -219,6 +220,11 @@ async def on_shutdown_configured(dispatcher: Dispatcher):
     ):
         await close_service(service_key)
 
+    try:
+        await close_crypt4_panel_service()
+    except Exception as e:
+        logging.warning(f"Failed to close crypt4 panel client: {e}")
+
     bot: Bot = dispatcher["bot_instance"]
     if bot and bot.session:
         try:
@@ -151,15 +151,20 @@ class PromoCodeService:
         _ = lambda k, **kw: self.i18n.gettext(user_lang, k, **kw)
         code_input_upper = code_input.strip().upper()
 
-        promo_data = await promo_code_dal.get_active_bonus_promo_code_by_code_str(
+        # Reserve an activation up front; every failure below must release it.
+        # The promo row stays locked until the caller commits, so concurrent
+        # claims of the same code cannot exceed max_activations.
+        promo_data = await promo_code_dal.claim_active_bonus_promo(
             session, code_input_upper)
 
         if not promo_data:
             return False, _("promo_code_not_found", code=code_input_upper)
 
-        existing_activation = await promo_code_dal.get_user_activation_for_promo(
+        already_activated = await promo_code_dal.user_has_activated_promo(
             session, promo_data.promo_code_id, user_id)
-        if existing_activation:
+        if already_activated:
+            await promo_code_dal.decrement_promo_code_usage(
+                session, promo_data.promo_code_id)
             return False, _("promo_code_already_used_by_user",
                             code=code_input_upper)
 
@@ -171,35 +176,35 @@ class PromoCodeService:
             bonus_days=bonus_days,
             reason=f"promo code {code_input_upper}")
 
-        if new_end_date:
-            activation_recorded = await promo_code_dal.record_promo_activation(
-                session, promo_data.promo_code_id, user_id, payment_id=None)
-            promo_incremented = await promo_code_dal.increment_promo_code_usage(
+        if not new_end_date:
+            await promo_code_dal.decrement_promo_code_usage(
                 session, promo_data.promo_code_id)
+            return False, _("error_applying_promo_bonus")
 
-            if activation_recorded and promo_incremented:
-                # Send notification about promo activation
-                try:
-                    notification_service = NotificationService(self.bot, self.settings, self.i18n)
-                    user = await user_dal.get_user_by_id(session, user_id)
-                    await notification_service.notify_promo_activation(
-                        user_id=user_id,
-                        promo_code=code_input_upper,
-                        bonus_days=bonus_days,
-                        username=user.username if user else None
-                    )
-                except Exception as e:
-                    logging.error(f"Failed to send promo activation notification: {e}")
-                
-                return True, new_end_date
-            else:
+        _activation, activation_created = await promo_code_dal.record_promo_activation(
+            session, promo_data.promo_code_id, user_id, payment_id=None)
 
-                logging.error(
-                    f"Failed to record activation or increment usage for promo {promo_data.code} by user {user_id}"
-                )
-                return False, _("error_applying_promo_bonus")
-        else:
-            return False, _("error_applying_promo_bonus")
+        if not activation_created:
+            # A concurrent request of the same user recorded the activation first
+            await promo_code_dal.decrement_promo_code_usage(
+                session, promo_data.promo_code_id)
+            return False, _("promo_code_already_used_by_user",
+                            code=code_input_upper)
+
+        # Send notification about promo activation
+        try:
+            notification_service = NotificationService(self.bot, self.settings, self.i18n)
+            user = await user_dal.get_user_by_id(session, user_id)
+            await notification_service.notify_promo_activation(
+                user_id=user_id,
+                promo_code=code_input_upper,
+                bonus_days=bonus_days,
+                username=user.username if user else None
+            )
+        except Exception as e:
+            logging.error(f"Failed to send promo activation notification: {e}")
+
+        return True, new_end_date
 
     async def apply_discount_promo_code(
         self,
@@ -215,13 +220,14 @@ class PromoCodeService:
         _ = lambda k, **kw: self.i18n.gettext(user_lang, k, **kw)
         code_input_upper = code_input.strip().upper()
 
-        # Check if user already has an active discount
-        existing_discount = await active_discount_dal.get_active_discount(
+        # Check if user already has an active discount (discount + promo in one lookup)
+        existing_with_promo = await active_discount_dal.get_active_discount_with_promo(
             session,
             user_id,
             include_expired=True,
         )
-        if existing_discount:
+        if existing_with_promo:
+            existing_discount, existing_promo = existing_with_promo
             now_utc = datetime.now(timezone.utc)
             if existing_discount.expires_at <= now_utc:
                 cleared = await active_discount_dal.clear_active_discount_if_expired(
@@ -234,34 +240,21 @@ class PromoCodeService:
                         session,
                         existing_discount.promo_code_id,
                     )
-                existing_discount = None
-
-        if existing_discount:
-            # Get the promo code for the existing discount
-            existing_promo = await promo_code_dal.get_promo_code_by_id(
-                session, existing_discount.promo_code_id
-            )
-            if existing_promo:
+            else:
                 return False, _("discount_promo_already_active",
                                code=existing_promo.code,
                                discount_pct=existing_discount.discount_percentage)
-            else:
-                # Existing discount but promo not found - clear it and continue
-                await active_discount_dal.clear_active_discount(session, user_id)
 
-        # Get discount promo code
-        promo_data = await promo_code_dal.get_active_discount_promo_code_by_code_str(
-            session, code_input_upper
+        # Get discount promo code and whether this user already used it
+        promo_lookup = await promo_code_dal.get_active_discount_promo_code_for_user(
+            session, code_input_upper, user_id
         )
 
-        if not promo_data:
+        if not promo_lookup:
             return False, _("promo_code_not_found_or_not_discount", code=code_input_upper)
 
-        # Check if user already used this code
-        existing_activation = await promo_code_dal.get_user_activation_for_promo(
-            session, promo_data.promo_code_id, user_id
-        )
-        if existing_activation:
+        promo_data, already_activated = promo_lookup
+        if already_activated:
             return False, _("promo_code_already_used_by_user", code=code_input_upper)
 
         # Reserve discount for limited time and count activation immediately
@@ -307,13 +300,14 @@ class PromoCodeService:
         Get user's active discount if any.
         Returns: (discount_percentage, promo_code) or None
         """
-        active_discount = await active_discount_dal.get_active_discount(
+        discount_with_promo = await active_discount_dal.get_active_discount_with_promo(
             session,
             user_id,
             include_expired=True,
         )
-        if not active_discount:
+        if not discount_with_promo:
             return None
+        active_discount, promo = discount_with_promo
 
         now_utc = datetime.now(timezone.utc)
         if active_discount.expires_at <= now_utc:
@@ -329,17 +323,8 @@ class PromoCodeService:
                 )
             return None
 
-        # Fetch promo code for code string
-        promo = await promo_code_dal.get_promo_code_by_id(
-            session, active_discount.promo_code_id
-        )
-        if not promo:
-            # Discount exists but promo not found - clear it
-            await active_discount_dal.clear_active_discount(session, user_id)
-            return None
-
         # Check if promo code has expired
-        if promo.valid_until and promo.valid_until <= datetime.now(timezone.utc):
+        if promo.valid_until and promo.valid_until <= now_utc:
             # Promo code expired - clear the discount
             logging.info(
                 f"Promo code {promo.code} expired (valid_until: {promo.valid_until}). "
@@ -361,15 +346,15 @@ class PromoCodeService:
         Calculate discounted price and discount amount.
         Returns: (final_price, discount_amount)
         """
-        discount_amount = round(original_price * (discount_percentage / 100), 2)
-        final_price = round(original_price - discount_amount, 2)
+        # Work in integer cents to avoid float rounding drift
+        original_cents = round(original_price * 100)
+        discount_cents = (original_cents * discount_percentage + 50) // 100
 
         # Ensure price doesn't go negative
-        if final_price < 0:
-            final_price = 0
-            discount_amount = original_price
+        if discount_cents > original_cents:
+            discount_cents = original_cents
 
-        return final_price, discount_amount
+        return (original_cents - discount_cents) / 100, discount_cents / 100
 
     async def consume_discount(
         self,
@@ -384,8 +369,8 @@ class PromoCodeService:
         concurrently expired/cleared, we still record promo activation and reconcile
         current_activations so successful discounted payments are always accounted for.
         """
-        payment_record = await payment_dal.get_payment_by_db_id(session, payment_id)
-        if not payment_record:
+        outcome = await payment_dal.consume_discount_atomic(session, user_id, payment_id)
+        if not outcome:
             logging.warning(
                 "Payment %s not found for discount consumption (user %s).",
                 payment_id,
@@ -393,10 +378,10 @@ class PromoCodeService:
             )
             return False
 
-        if not payment_record.discount_applied:
+        if not outcome["discount_applied"]:
             return False
 
-        promo_code_id = payment_record.promo_code_id
+        promo_code_id = outcome["promo_code_id"]
         if not promo_code_id:
             logging.warning(
                 "Payment %s for user %s has discount_applied but no promo_code_id.",
@@ -405,73 +390,33 @@ class PromoCodeService:
             )
             return False
 
-        existing_activation = await promo_code_dal.get_user_activation_for_promo(
-            session, promo_code_id, user_id
-        )
-
-        activation_created = False
-        if existing_activation:
-            if existing_activation.payment_id is None:
-                updated_payment = await promo_code_dal.set_activation_payment_id(
-                    session, promo_code_id, user_id, payment_id
-                )
-                if updated_payment:
-                    logging.info(
-                        "Linked discount promo %s activation to payment %s for user %s.",
-                        promo_code_id,
-                        payment_id,
-                        user_id,
-                    )
-        else:
-            activation_recorded = await promo_code_dal.record_promo_activation(
-                session,
+        if outcome["activation_linked"]:
+            logging.info(
+                "Linked discount promo %s activation to payment %s for user %s.",
                 promo_code_id,
+                payment_id,
                 user_id,
-                payment_id=payment_id,
-            )
-            if not activation_recorded:
-                logging.error(
-                    "Failed to record discount activation for user %s, promo %s.",
-                    user_id,
-                    promo_code_id,
-                )
-                return False
-            activation_created = True
-
-        active_discount = await active_discount_dal.get_active_discount(
-            session,
-            user_id,
-            include_expired=True,
-        )
-
-        # Reservation is best-effort cleanup at this point; payment success already happened.
-        if active_discount and active_discount.promo_code_id == promo_code_id:
-            await active_discount_dal.clear_active_discount_if_matches(
-                session,
-                user_id=user_id,
-                promo_code_id=promo_code_id,
             )
-        elif active_discount and active_discount.promo_code_id != promo_code_id:
-            logging.info(
-                "Active discount promo %s differs from payment promo %s during consumption.",
-                active_discount.promo_code_id,
+        elif not outcome["activation_existed"] and not outcome["activation_created"]:
+            logging.warning(
+                "Discount activation for user %s, promo %s was recorded concurrently.",
+                user_id,
                 promo_code_id,
             )
-        else:
+
+        reservation_promo_code_id = outcome["reservation_promo_code_id"]
+        if reservation_promo_code_id is None:
             logging.info(
                 "Discount reservation already absent at consumption time (user=%s, promo=%s, payment=%s)",
                 user_id,
                 promo_code_id,
                 payment_id,
             )
-
-        # If reservation was already expired/removed and we had to create activation now,
-        # restore current_activations to match the successful payment.
-        if activation_created:
-            await promo_code_dal.increment_promo_code_usage(
-                session,
+        elif reservation_promo_code_id != promo_code_id:
+            logging.info(
+                "Active discount promo %s differs from payment promo %s during consumption.",
+                reservation_promo_code_id,
                 promo_code_id,
-                allow_overflow=True,
             )
 
         await session.flush()
@@ -607,13 +607,13 @@ class SubscriptionService:
                 applied_promo_bonus_days = promo_model.bonus_days or 0
                 duration_days_total += applied_promo_bonus_days
 
-                activation = await promo_code_dal.record_promo_activation(
+                _activation, activation_created = await promo_code_dal.record_promo_activation(
                     session,
                     promo_code_id_from_payment,
                     user_id,
                     payment_id=payment_db_id,
                 )
-                if activation:
+                if activation_created:
                     await promo_code_dal.increment_promo_code_usage(
                         session, promo_code_id_from_payment, allow_overflow=True
                     )
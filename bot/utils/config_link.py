@@ -1,19 +1,59 @@
 import logging
+from collections import OrderedDict
 from typing import Optional, Tuple
 
 from config.settings import Settings
 from bot.services.panel_api_service import PanelApiService
 
 
+_CRYPT4_PANEL_SERVICE: Optional[PanelApiService] = None
+
+_ENCRYPTED_LINK_CACHE_MAXSIZE = 4096
+_encrypted_link_cache: "OrderedDict[str, str]" = OrderedDict()
+
+
+def _get_crypt4_panel_service(settings: Settings) -> PanelApiService:
+    """Return the process-wide panel client used for crypt4, creating it on first use."""
+    global _CRYPT4_PANEL_SERVICE
+    if _CRYPT4_PANEL_SERVICE is None:
+        _CRYPT4_PANEL_SERVICE = PanelApiService(settings)
+    return _CRYPT4_PANEL_SERVICE
+
+
+async def close_crypt4_panel_service() -> None:
+    """Close the HTTP session of the shared crypt4 panel client, if it was created."""
+    if _CRYPT4_PANEL_SERVICE is not None:
+        await _CRYPT4_PANEL_SERVICE.close_session()
+
+
 async def _encrypt_raw_link(settings: Settings, raw_link: str) -> Optional[str]:
     """Encrypt the raw subscription URL using the panel's happ crypt4 API."""
-    async with PanelApiService(settings) as panel_service:
-        encrypted_link = await panel_service.encrypt_happ_link(raw_link)
-        if encrypted_link:
-            return encrypted_link
+    panel_service = _get_crypt4_panel_service(settings)
+    encrypted_link = await panel_service.encrypt_happ_link(raw_link)
+    if encrypted_link:
+        return encrypted_link
     return None
 
 
+async def _encrypt_raw_link_cached(settings: Settings, raw_link: str) -> Optional[str]:
+    """
+    Encrypt the raw link once and reuse the payload for subsequent renders.
+    Any previously issued payload stays valid, so a stable one per link is fine.
+    Failures are not cached.
+    """
+    cached = _encrypted_link_cache.get(raw_link)
+    if cached is not None:
+        _encrypted_link_cache.move_to_end(raw_link)
+        return cached
+
+    encrypted_link = await _encrypt_raw_link(settings, raw_link)
+    if encrypted_link:
+        _encrypted_link_cache[raw_link] = encrypted_link
+        while len(_encrypted_link_cache) > _ENCRYPTED_LINK_CACHE_MAXSIZE:
+            _encrypted_link_cache.popitem(last=False)
+    return encrypted_link
+
+
 async def prepare_config_links(settings: Settings, raw_link: Optional[str]) -> Tuple[Optional[str], Optional[str]]:
     """
     Build the user-facing connection key and the URL for the connect button.
@@ -30,18 +70,12 @@ async def prepare_config_links(settings: Settings, raw_link: Optional[str]) -> T
         return None, None
 
     display_link = cleaned
-    button_link = cleaned
 
     if settings.CRYPT4_ENABLED:
-        encrypted_payload = await _encrypt_raw_link(settings, cleaned)
+        encrypted_payload = await _encrypt_raw_link_cached(settings, cleaned)
         if encrypted_payload:
             display_link = encrypted_payload
-            button_link = display_link
         else:
             logging.error("CRYPT4_ENABLED is set but encryption failed; using raw link as fallback.")
 
-    redirect_base = (settings.CRYPT4_REDIRECT_URL or "").strip()
-    if redirect_base and settings.CRYPT4_ENABLED and display_link:
-        button_link = f"{redirect_base}{display_link}"
-
-    return display_link, button_link
+    return display_link, settings.crypt4_button_builder(display_link)
@@ -1,7 +1,8 @@
 import logging
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from pydantic import Field, ValidationError, computed_field, field_validator, model_validator
-from typing import Optional, List, Dict, Any
+from functools import cached_property
+from typing import Callable, Optional, List, Dict, Any
 
 
 class Settings(BaseSettings):
@@ -16,6 +17,9 @@ class Settings(BaseSettings):
     POSTGRES_HOST: str = Field(default="localhost")
     POSTGRES_PORT: int = Field(default=5432)
     POSTGRES_DB: str = Field(default="vpn_shop_db")
+    DB_POOL_SIZE: int = Field(default=20, description="Persistent connections kept in the SQLAlchemy pool")
+    DB_MAX_OVERFLOW: int = Field(default=20, description="Extra connections allowed above DB_POOL_SIZE under load")
+    DB_POOL_RECYCLE_SECONDS: int = Field(default=1800, description="Recycle pooled connections older than this")
 
     DEFAULT_LANGUAGE: str = Field(default="ru")
 
@@ -353,6 +357,14 @@ class Settings(BaseSettings):
             return f"{base.rstrip('/')}{self.panel_webhook_path}"
         return None
 
+    @cached_property
+    def crypt4_button_builder(self) -> Callable[[str], str]:
+        """Connect-button URL builder, specialized once for the crypt4 redirect settings."""
+        redirect_base = (self.CRYPT4_REDIRECT_URL or "").strip()
+        if self.CRYPT4_ENABLED and redirect_base:
+            return lambda link: f"{redirect_base}{link}"
+        return lambda link: link
+
     @computed_field
     @property
     def cryptopay_webhook_path(self) -> str:
@@ -1,20 +1,147 @@
+import asyncio
 import logging
+import secrets
 from pathlib import Path
-from typing import Tuple
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple
 
 from alembic import command
 from alembic.config import Config
+from alembic.script import ScriptDirectory
 from sqlalchemy import inspect, text
-from sqlalchemy.engine import Connection
+from sqlalchemy.sql.elements import TextClause
+from sqlalchemy.engine import Connection, Inspector
 from sqlalchemy.ext.asyncio import AsyncEngine
 
 from config.settings import Settings
+from db.dal.user_dal import REFERRAL_CODE_ALPHABET, REFERRAL_CODE_LENGTH
 
 
 import os
 _BASELINE_REVISION = "0001_initial_schema"
 
 
+# Static statements are built once at import and reused on every run
+_EXISTING_TABLES_SQL = text(
+    "SELECT c.relname FROM pg_catalog.pg_class c "
+    "JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace "
+    "WHERE n.nspname = current_schema() "
+    "AND c.relkind IN ('r', 'p') "
+    "AND c.relname = ANY(:table_names)"
+)
+
+_NORMALIZE_REFERRAL_CODES_SQL = text(
+    """
+    UPDATE users
+    SET referral_code = NULLIF(UPPER(BTRIM(referral_code)), '')
+    WHERE referral_code IS NOT NULL
+      AND referral_code IS DISTINCT FROM NULLIF(UPPER(BTRIM(referral_code)), '')
+    """
+)
+
+_DEDUPE_REFERRAL_CODES_SQL = text(
+    """
+    WITH duplicate_codes AS (
+        SELECT
+            user_id,
+            ROW_NUMBER() OVER (
+                PARTITION BY referral_code
+                ORDER BY user_id
+            ) AS rn
+        FROM users
+        WHERE referral_code IS NOT NULL
+    )
+    UPDATE users AS u
+    SET referral_code = UPPER(LPAD(TO_HEX(FLOOR(random() * 68719476736)::BIGINT), 9, '0'))
+    FROM duplicate_codes AS d
+    WHERE u.user_id = d.user_id
+      AND d.rn > 1
+    """
+)
+
+_BACKFILL_REFERRAL_CODES_SQL = text(
+    """
+    WITH generated_codes AS (
+        SELECT
+            user_id,
+            UPPER(LPAD(TO_HEX(FLOOR(random() * 68719476736)::BIGINT), 9, '0')) AS referral_code
+        FROM users
+        WHERE referral_code IS NULL
+    )
+    UPDATE users AS u
+    SET referral_code = g.referral_code
+    FROM generated_codes AS g
+    WHERE u.user_id = g.user_id
+    """
+)
+
+_MISSING_REFERRAL_CODE_USER_IDS_SQL = text(
+    "SELECT user_id FROM users WHERE referral_code IS NULL LIMIT :limit"
+)
+
+# Codes already taken by other users are skipped and left to the server-side pass.
+# NOT EXISTS only sees rows from before the statement, so the batch itself must be unique.
+_ASSIGN_REFERRAL_CODES_SQL = text(
+    """
+    UPDATE users AS u
+    SET referral_code = v.code
+    FROM unnest(CAST(:user_ids AS BIGINT[]), CAST(:codes AS VARCHAR[])) AS v(user_id, code)
+    WHERE u.user_id = v.user_id
+      AND u.referral_code IS NULL
+      AND NOT EXISTS (SELECT 1 FROM users x WHERE x.referral_code = v.code)
+    """
+)
+
+_BACKFILL_CURRENT_ACTIVATIONS_SQL = text(
+    "UPDATE promo_codes SET current_activations = 0 "
+    "WHERE current_activations IS NULL"
+)
+
+_CREATE_ACTIVE_DISCOUNTS_SQL = text(
+    """
+    CREATE TABLE IF NOT EXISTS active_discounts (
+        user_id BIGINT PRIMARY KEY,
+        promo_code_id INTEGER NOT NULL,
+        discount_percentage INTEGER NOT NULL,
+        activated_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+        CONSTRAINT fk_active_discounts_user
+            FOREIGN KEY (user_id) REFERENCES users (user_id) ON DELETE CASCADE,
+        CONSTRAINT fk_active_discounts_promo_code
+            FOREIGN KEY (promo_code_id) REFERENCES promo_codes (promo_code_id) ON DELETE CASCADE
+    )
+    """
+)
+
+_DELETE_ORPHAN_ACTIVE_DISCOUNTS_SQL = text(
+    "DELETE FROM active_discounts ad "
+    "WHERE NOT EXISTS (SELECT 1 FROM users u WHERE u.user_id = ad.user_id) "
+    "OR NOT EXISTS (SELECT 1 FROM promo_codes p WHERE p.promo_code_id = ad.promo_code_id)"
+)
+
+_ACTIVE_DISCOUNTS_HAS_ROWS_SQL = text("SELECT EXISTS (SELECT 1 FROM active_discounts)")
+
+# Single ALTER: PostgreSQL applies the drops before the adds within one statement
+_REPAIR_ACTIVE_DISCOUNT_FKS_SQL = text(
+    "ALTER TABLE active_discounts "
+    "DROP CONSTRAINT IF EXISTS active_discounts_user_id_fkey, "
+    "DROP CONSTRAINT IF EXISTS fk_active_discounts_user, "
+    "DROP CONSTRAINT IF EXISTS active_discounts_promo_code_id_fkey, "
+    "DROP CONSTRAINT IF EXISTS fk_active_discounts_promo_code, "
+    "ADD CONSTRAINT fk_active_discounts_user "
+    "FOREIGN KEY (user_id) REFERENCES users (user_id) ON DELETE CASCADE, "
+    "ADD CONSTRAINT fk_active_discounts_promo_code "
+    "FOREIGN KEY (promo_code_id) REFERENCES promo_codes (promo_code_id) ON DELETE CASCADE"
+)
+
+_TABLE_EXISTS_SQL = text("SELECT to_regclass(:table_name) IS NOT NULL")
+
+_INDEX_IS_VALID_SQL = text(
+    "SELECT i.indisvalid FROM pg_catalog.pg_index i "
+    "WHERE i.indexrelid = to_regclass(:index_name)"
+)
+
+_ALEMBIC_VERSION_SQL = text("SELECT version_num FROM alembic_version")
+
+
 def _build_alembic_config(settings: Settings) -> Config:
     project_root = Path(__file__).resolve().parents[1]
     config = Config(str(project_root / "alembic.ini"))
@@ -24,248 +151,211 @@ def _build_alembic_config(settings: Settings) -> Config:
 
 
 def _inspect_database_state(connection: Connection) -> Tuple[bool, bool, bool]:
-    db_inspector = inspect(connection)
-    has_alembic_version = db_inspector.has_table("alembic_version")
-    has_users_table = db_inspector.has_table("users")
-    has_legacy_migrator_table = db_inspector.has_table("schema_migrations")
+    # One catalog probe for all marker tables instead of a has_table() query each
+    existing_tables = set(
+        connection.execute(
+            _EXISTING_TABLES_SQL,
+            {"table_names": ["alembic_version", "users", "schema_migrations"]},
+        ).scalars()
+    )
+    has_alembic_version = "alembic_version" in existing_tables
+    has_users_table = "users" in existing_tables
+    has_legacy_migrator_table = "schema_migrations" in existing_tables
     return has_alembic_version, has_users_table, has_legacy_migrator_table
 
 
-def _run_legacy_migrator_compatibility(connection: Connection) -> None:
-    db_inspector = inspect(connection)
-    if not db_inspector.has_table("users"):
+class _SchemaCache:
+    """
+    Reflects table presence and column names at most once per table for the
+    legacy compatibility pass. Call invalidate() after DDL touching a table.
+    """
+
+    def __init__(self, connection: Connection):
+        self._inspector: Inspector = inspect(connection)
+        self._tables: Dict[str, bool] = {}
+        self._columns: Dict[str, Set[str]] = {}
+
+    def prefetch(self, tables: Sequence[str]) -> None:
+        """Reflect columns of several tables in one batched query (SQLAlchemy 2.0+)."""
+        if not hasattr(self._inspector, "get_multi_columns"):
+            return
+        multi_columns = self._inspector.get_multi_columns(
+            schema=None, filter_names=list(tables)
+        )
+        for (_schema, table), columns in multi_columns.items():
+            self._tables[table] = True
+            self._columns[table] = {column["name"] for column in columns}
+
+    def has_table(self, table: str) -> bool:
+        if table not in self._tables:
+            self._tables[table] = self._inspector.has_table(table)
+        return self._tables[table]
+
+    def columns(self, table: str) -> Set[str]:
+        if table not in self._columns:
+            self._columns[table] = {
+                column["name"]
+                for column in self._inspector.get_columns(table)
+            }
+        return self._columns[table]
+
+    def index_names(self, table: str) -> Set[str]:
+        return {index["name"] for index in self._inspector.get_indexes(table)}
+
+    def foreign_keys(self, table: str) -> List[Dict[str, Any]]:
+        return self._inspector.get_foreign_keys(table)
+
+    def invalidate(self, table: str) -> None:
+        self._tables.pop(table, None)
+        self._columns.pop(table, None)
+        # Inspector memoizes reflection results too
+        self._inspector.clear_cache()
+
+
+def _dedupe_referral_codes(connection: Connection) -> None:
+    connection.execute(_DEDUPE_REFERRAL_CODES_SQL)
+
+
+_REFERRAL_PYTHON_BACKFILL_LIMIT = 5000
+
+
+def _assign_referral_codes_from_python(connection: Connection) -> None:
+    """
+    For small backlogs generate codes in Python (same alphabet as new users get)
+    and apply them with a single UPDATE ... FROM unnest(...).
+    """
+    user_ids = list(
+        connection.execute(
+            _MISSING_REFERRAL_CODE_USER_IDS_SQL,
+            {"limit": _REFERRAL_PYTHON_BACKFILL_LIMIT + 1},
+        ).scalars()
+    )
+    if not user_ids or len(user_ids) > _REFERRAL_PYTHON_BACKFILL_LIMIT:
         return
+    codes: Set[str] = set()
+    while len(codes) < len(user_ids):
+        codes.add(
+            "".join(secrets.choice(REFERRAL_CODE_ALPHABET) for _ in range(REFERRAL_CODE_LENGTH))
+        )
+    connection.execute(
+        _ASSIGN_REFERRAL_CODES_SQL,
+        {"user_ids": user_ids, "codes": list(codes)},
+    )
+
+
+def _backfill_referral_codes(connection: Connection) -> None:
+    # One UPDATE on purpose: the pass shares the stamp/upgrade transaction, so
+    # batching could not commit or release locks between batches anyway.
+    _assign_referral_codes_from_python(connection)
+    connection.execute(_BACKFILL_REFERRAL_CODES_SQL)
+
 
-    users_columns = {
-        column["name"]
-        for column in db_inspector.get_columns("users")
+_ACTIVE_DISCOUNT_FKS = {
+    "fk_active_discounts_user": "users",
+    "fk_active_discounts_promo_code": "promo_codes",
+}
+
+
+def _active_discount_fks_are_cascading(schema: _SchemaCache) -> bool:
+    """True when active_discounts has exactly the expected ON DELETE CASCADE FKs."""
+    foreign_keys = {
+        foreign_key.get("name"): foreign_key
+        for foreign_key in schema.foreign_keys("active_discounts")
     }
-    user_alter_statements = []
+    if set(foreign_keys) != set(_ACTIVE_DISCOUNT_FKS):
+        return False
+    for name, referred_table in _ACTIVE_DISCOUNT_FKS.items():
+        foreign_key = foreign_keys[name]
+        ondelete = (foreign_key.get("options") or {}).get("ondelete", "")
+        if foreign_key.get("referred_table") != referred_table or ondelete.upper() != "CASCADE":
+            return False
+    return True
+
+
+def _run_legacy_migrator_compatibility(connection: Connection) -> None:
+    schema = _SchemaCache(connection)
+    schema.prefetch(("users", "payments", "promo_codes", "active_discounts"))
+    if not schema.has_table("users"):
+        return
+
+    users_columns = schema.columns("users")
+    user_alter_clauses = []
 
     if "channel_subscription_verified" not in users_columns:
-        user_alter_statements.append(
-            "ALTER TABLE users ADD COLUMN channel_subscription_verified BOOLEAN"
-        )
+        user_alter_clauses.append("ADD COLUMN channel_subscription_verified BOOLEAN")
     if "channel_subscription_checked_at" not in users_columns:
-        user_alter_statements.append(
-            "ALTER TABLE users ADD COLUMN channel_subscription_checked_at TIMESTAMPTZ"
-        )
+        user_alter_clauses.append("ADD COLUMN channel_subscription_checked_at TIMESTAMPTZ")
     if "channel_subscription_verified_for" not in users_columns:
-        user_alter_statements.append(
-            "ALTER TABLE users ADD COLUMN channel_subscription_verified_for BIGINT"
-        )
+        user_alter_clauses.append("ADD COLUMN channel_subscription_verified_for BIGINT")
     if "referral_code" not in users_columns:
-        user_alter_statements.append(
-            "ALTER TABLE users ADD COLUMN referral_code VARCHAR(16)"
-        )
+        user_alter_clauses.append("ADD COLUMN referral_code VARCHAR(16)")
 
-    for statement in user_alter_statements:
-        connection.execute(text(statement))
+    # One multi-clause ALTER takes the table lock once instead of per column
+    if user_alter_clauses:
+        connection.execute(text("ALTER TABLE users " + ", ".join(user_alter_clauses)))
+        schema.invalidate("users")
 
-    users_columns = {
-        column["name"]
-        for column in inspect(connection).get_columns("users")
-    }
-    if "referral_code" in users_columns:
-        connection.execute(
-            text(
-                """
-                UPDATE users
-                SET referral_code = NULLIF(UPPER(BTRIM(referral_code)), '')
-                WHERE referral_code IS NOT NULL
-                """
-            )
-        )
-        connection.execute(
-            text(
-                """
-                WITH duplicate_codes AS (
-                    SELECT
-                        user_id,
-                        ROW_NUMBER() OVER (
-                            PARTITION BY referral_code
-                            ORDER BY user_id
-                        ) AS rn
-                    FROM users
-                    WHERE referral_code IS NOT NULL
-                )
-                UPDATE users AS u
-                SET referral_code = UPPER(
-                    SUBSTRING(
-                        md5(
-                            u.user_id::text
-                            || clock_timestamp()::text
-                            || random()::text
-                        )
-                        FROM 1 FOR 9
-                    )
-                )
-                FROM duplicate_codes AS d
-                WHERE u.user_id = d.user_id
-                  AND d.rn > 1
-                """
-            )
-        )
-        connection.execute(
-            text(
-                """
-                WITH generated_codes AS (
-                    SELECT
-                        user_id,
-                        UPPER(
-                            SUBSTRING(
-                                md5(
-                                    user_id::text
-                                    || clock_timestamp()::text
-                                    || random()::text
-                                )
-                                FROM 1 FOR 9
-                            )
-                        ) AS referral_code
-                    FROM users
-                    WHERE referral_code IS NULL
-                )
-                UPDATE users AS u
-                SET referral_code = g.referral_code
-                FROM generated_codes AS g
-                WHERE u.user_id = g.user_id
-                """
-            )
-        )
-        connection.execute(
-            text(
-                """
-                CREATE UNIQUE INDEX IF NOT EXISTS uq_users_referral_code
-                ON users (referral_code)
-                WHERE referral_code IS NOT NULL
-                """
-            )
-        )
+    if "referral_code" in schema.columns("users"):
+        # Only rewrite rows that actually change; an already normalized table is a no-op
+        normalized = connection.execute(_NORMALIZE_REFERRAL_CODES_SQL)
+        # The unique index already rules out duplicates unless normalization just changed codes
+        if normalized.rowcount or "uq_users_referral_code" not in schema.index_names("users"):
+            _dedupe_referral_codes(connection)
 
-    db_inspector = inspect(connection)
-    if db_inspector.has_table("payments"):
-        payments_columns = {
-            column["name"]
-            for column in db_inspector.get_columns("payments")
-        }
+        _backfill_referral_codes(connection)
+
+    if schema.has_table("payments"):
+        payments_columns = schema.columns("payments")
+        payment_alter_clauses = []
         if "original_amount" not in payments_columns:
-            connection.execute(text("ALTER TABLE payments ADD COLUMN original_amount FLOAT"))
+            payment_alter_clauses.append("ADD COLUMN original_amount FLOAT")
         if "discount_applied" not in payments_columns:
-            connection.execute(text("ALTER TABLE payments ADD COLUMN discount_applied FLOAT"))
+            payment_alter_clauses.append("ADD COLUMN discount_applied FLOAT")
+        if payment_alter_clauses:
+            connection.execute(
+                text("ALTER TABLE payments " + ", ".join(payment_alter_clauses))
+            )
 
-    db_inspector = inspect(connection)
-    has_promo_codes = db_inspector.has_table("promo_codes")
+    has_promo_codes = schema.has_table("promo_codes")
     if has_promo_codes:
-        promo_columns = {
-            column["name"]
-            for column in db_inspector.get_columns("promo_codes")
-        }
+        promo_columns = schema.columns("promo_codes")
+        promo_alter_clauses = []
         if "promo_type" not in promo_columns:
-            connection.execute(
-                text(
-                    "ALTER TABLE promo_codes ADD COLUMN promo_type VARCHAR NOT NULL DEFAULT 'bonus_days'"
-                )
+            promo_alter_clauses.append(
+                "ADD COLUMN promo_type VARCHAR NOT NULL DEFAULT 'bonus_days'"
             )
         if "discount_percentage" not in promo_columns:
-            connection.execute(
-                text("ALTER TABLE promo_codes ADD COLUMN discount_percentage INTEGER")
-            )
+            promo_alter_clauses.append("ADD COLUMN discount_percentage INTEGER")
         if "current_activations" not in promo_columns:
-            connection.execute(
-                text(
-                    "ALTER TABLE promo_codes ADD COLUMN current_activations INTEGER NOT NULL DEFAULT 0"
-                )
+            promo_alter_clauses.append(
+                "ADD COLUMN current_activations INTEGER NOT NULL DEFAULT 0"
             )
         else:
-            connection.execute(
-                text(
-                    "UPDATE promo_codes SET current_activations = 0 "
-                    "WHERE current_activations IS NULL"
-                )
-            )
-            connection.execute(
-                text("ALTER TABLE promo_codes ALTER COLUMN current_activations SET DEFAULT 0")
-            )
-            connection.execute(
-                text("ALTER TABLE promo_codes ALTER COLUMN current_activations SET NOT NULL")
-            )
+            # Backfill must run before the NOT NULL clause below
+            connection.execute(_BACKFILL_CURRENT_ACTIVATIONS_SQL)
+            promo_alter_clauses.append("ALTER COLUMN current_activations SET DEFAULT 0")
+            promo_alter_clauses.append("ALTER COLUMN current_activations SET NOT NULL")
         if "bonus_days" in promo_columns:
+            promo_alter_clauses.append("ALTER COLUMN bonus_days DROP NOT NULL")
+        if promo_alter_clauses:
             connection.execute(
-                text("ALTER TABLE promo_codes ALTER COLUMN bonus_days DROP NOT NULL")
+                text("ALTER TABLE promo_codes " + ", ".join(promo_alter_clauses))
             )
-        connection.execute(
-            text(
-                "CREATE INDEX IF NOT EXISTS idx_promo_codes_promo_type ON promo_codes (promo_type)"
-            )
-        )
 
-    db_inspector = inspect(connection)
-    has_active_discounts = db_inspector.has_table("active_discounts")
+    has_active_discounts = schema.has_table("active_discounts")
     if not has_active_discounts and has_promo_codes:
-        connection.execute(
-            text(
-                """
-                CREATE TABLE IF NOT EXISTS active_discounts (
-                    user_id BIGINT PRIMARY KEY,
-                    promo_code_id INTEGER NOT NULL,
-                    discount_percentage INTEGER NOT NULL,
-                    activated_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
-                    CONSTRAINT fk_active_discounts_user
-                        FOREIGN KEY (user_id) REFERENCES users (user_id) ON DELETE CASCADE,
-                    CONSTRAINT fk_active_discounts_promo_code
-                        FOREIGN KEY (promo_code_id) REFERENCES promo_codes (promo_code_id) ON DELETE CASCADE
-                )
-                """
-            )
-        )
+        connection.execute(_CREATE_ACTIVE_DISCOUNTS_SQL)
         has_active_discounts = True
 
-    if has_active_discounts and has_promo_codes:
-        connection.execute(
-            text(
-                "DELETE FROM active_discounts ad "
-                "WHERE NOT EXISTS (SELECT 1 FROM users u WHERE u.user_id = ad.user_id) "
-                "OR NOT EXISTS (SELECT 1 FROM promo_codes p WHERE p.promo_code_id = ad.promo_code_id)"
-            )
-        )
-        connection.execute(
-            text(
-                "ALTER TABLE active_discounts "
-                "DROP CONSTRAINT IF EXISTS active_discounts_user_id_fkey"
-            )
-        )
-        connection.execute(
-            text(
-                "ALTER TABLE active_discounts "
-                "DROP CONSTRAINT IF EXISTS fk_active_discounts_user"
-            )
-        )
-        connection.execute(
-            text(
-                "ALTER TABLE active_discounts "
-                "DROP CONSTRAINT IF EXISTS active_discounts_promo_code_id_fkey"
-            )
-        )
-        connection.execute(
-            text(
-                "ALTER TABLE active_discounts "
-                "DROP CONSTRAINT IF EXISTS fk_active_discounts_promo_code"
-            )
-        )
-        connection.execute(
-            text(
-                "ALTER TABLE active_discounts "
-                "ADD CONSTRAINT fk_active_discounts_user "
-                "FOREIGN KEY (user_id) REFERENCES users (user_id) ON DELETE CASCADE"
-            )
-        )
-        connection.execute(
-            text(
-                "ALTER TABLE active_discounts "
-                "ADD CONSTRAINT fk_active_discounts_promo_code "
-                "FOREIGN KEY (promo_code_id) REFERENCES promo_codes (promo_code_id) ON DELETE CASCADE"
-            )
+    if has_active_discounts and has_promo_codes and _active_discount_fks_are_cascading(schema):
+        logging.info(
+            "Alembic legacy compatibility: active_discounts FKs already cascade; skipping repair."
         )
+    elif has_active_discounts and has_promo_codes:
+        # Orphan cleanup scans the whole table; an empty one has nothing to clean
+        if connection.execute(_ACTIVE_DISCOUNTS_HAS_ROWS_SQL).scalar_one():
+            connection.execute(_DELETE_ORPHAN_ACTIVE_DISCOUNTS_SQL)
+        connection.execute(_REPAIR_ACTIVE_DISCOUNT_FKS_SQL)
     elif has_active_discounts and not has_promo_codes:
         logging.warning(
             "Alembic legacy compatibility: skipped active_discounts FK repair "
@@ -273,6 +363,92 @@ def _run_legacy_migrator_compatibility(connection: Connection) -> None:
         )
 
 
+# Built outside the migration transaction so writers are not blocked. Checked on every
+# start of a legacy database so a build that failed or was interrupted is retried.
+_LEGACY_CONCURRENT_INDEXES = (
+    (
+        "users",
+        "uq_users_referral_code",
+        text(
+            "CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS uq_users_referral_code "
+            "ON users (referral_code) WHERE referral_code IS NOT NULL"
+        ),
+        # Random backfills may have produced duplicates that would fail the build again
+        _DEDUPE_REFERRAL_CODES_SQL,
+    ),
+    (
+        "promo_codes",
+        "idx_promo_codes_promo_type",
+        text(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_promo_codes_promo_type "
+            "ON promo_codes (promo_type)"
+        ),
+        None,
+    ),
+)
+
+
+def _create_legacy_index_concurrently(
+        connection: Connection,
+        table: str,
+        index_name: str,
+        create_statement: TextClause,
+        prepare_statement: Optional[TextClause]) -> None:
+    """Must run on an AUTOCOMMIT connection: CONCURRENTLY is not allowed in a transaction."""
+    table_exists = connection.execute(
+        _TABLE_EXISTS_SQL,
+        {"table_name": table},
+    ).scalar_one()
+    if not table_exists:
+        return
+
+    # A failed concurrent build leaves an INVALID index that IF NOT EXISTS would keep
+    is_valid = connection.execute(
+        _INDEX_IS_VALID_SQL,
+        {"index_name": index_name},
+    ).scalar_one_or_none()
+    if is_valid:
+        return
+    if is_valid is False:
+        logging.warning(
+            "Alembic legacy compatibility: rebuilding invalid index %s.", index_name
+        )
+        connection.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {index_name}"))
+
+    logging.info("Alembic legacy compatibility: building index %s concurrently.", index_name)
+    if prepare_statement is not None:
+        connection.execute(prepare_statement)
+    connection.execute(create_statement)
+
+
+async def _build_legacy_index(
+        async_engine: AsyncEngine,
+        table: str,
+        index_name: str,
+        create_statement: TextClause,
+        prepare_statement: Optional[TextClause]) -> None:
+    async with async_engine.connect() as async_connection:
+        autocommit_connection = await async_connection.execution_options(
+            isolation_level="AUTOCOMMIT"
+        )
+        await autocommit_connection.run_sync(
+            _create_legacy_index_concurrently,
+            table,
+            index_name,
+            create_statement,
+            prepare_statement,
+        )
+
+
+def _is_at_head(connection: Connection, alembic_config: Config) -> bool:
+    """Cheap steady-state check: alembic_version already matches the script heads."""
+    script_heads = set(ScriptDirectory.from_config(alembic_config).get_heads())
+    current_revisions = set(
+        connection.execute(_ALEMBIC_VERSION_SQL).scalars()
+    )
+    return current_revisions == script_heads
+
+
 def _run_stamp(connection: Connection, alembic_config: Config, revision: str) -> None:
     alembic_config.attributes["connection"] = connection
     command.stamp(alembic_config, revision)
@@ -294,6 +470,8 @@ async def run_alembic_migrations(settings: Settings, async_engine: AsyncEngine)
         "on",
     }
 
+    # Compatibility fixes, stamp and upgrade share this one transaction. Alembic sees
+    # the external transaction and runs migrations inline, without per-migration SAVEPOINTs.
     async with async_engine.begin() as async_connection:
         (
             has_alembic_version,
@@ -333,7 +511,23 @@ async def run_alembic_migrations(settings: Settings, async_engine: AsyncEngine)
                 _BASELINE_REVISION,
             )
 
-        logging.info("Alembic: running upgrade to head...")
-        await async_connection.run_sync(_run_upgrade, alembic_config)
+        if has_alembic_version and await async_connection.run_sync(
+            _is_at_head, alembic_config
+        ):
+            logging.info("Alembic: database already at head; skipping upgrade.")
+        else:
+            logging.info("Alembic: running upgrade to head...")
+            await async_connection.run_sync(_run_upgrade, alembic_config)
+
+    if has_legacy_migrator_table:
+        # Existence/validity probe is cheap; only a missing or invalid index is (re)built.
+        # Indexes are on different tables, so each runs on its own connection in parallel.
+        await asyncio.gather(*(
+            _build_legacy_index(
+                async_engine, table, index_name, create_statement, prepare_statement
+            )
+            for table, index_name, create_statement, prepare_statement
+            in _LEGACY_CONCURRENT_INDEXES
+        ))
 
     logging.info("Alembic: migrations applied successfully.")
@@ -0,0 +1,105 @@
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from db.models import ActiveDiscount, PromoCode
+
+CachedDiscount = Optional[Tuple[ActiveDiscount, PromoCode]]
+
+MISS = object()
+
+# session.info key holding user_ids (None = everything) to drop once the transaction ends
+_PENDING_INFO_KEY = "active_discount_cache_pending"
+
+
+def _snapshot(instance: Any) -> Any:
+    """Copy loaded column values into a new transient instance not bound to any session."""
+    mapper = inspect(instance).mapper
+    copy = mapper.class_()
+    for attr in mapper.column_attrs:
+        setattr(copy, attr.key, getattr(instance, attr.key))
+    return copy
+
+
+class ActiveDiscountCache:
+    """
+    Small in-process TTL cache for active discount lookups keyed by user_id.
+    Stores None for users without a discount; entries are read-only snapshots.
+    Writers must use invalidate_on_commit so entries are dropped after their
+    transaction ends, not while the old row is still the committed one.
+    """
+
+    def __init__(self, maxsize: int = 10_000, ttl: float = 30.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: Dict[int, Tuple[float, CachedDiscount]] = {}
+        # Bumped on every invalidation; a load that started before it is not cached
+        self._version = 0
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    def get(self, user_id: int) -> Any:
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return MISS
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            self._entries.pop(user_id, None)
+            return MISS
+        return value
+
+    def set(self, user_id: int, value: CachedDiscount,
+            version: Optional[int] = None) -> None:
+        if version is not None and version != self._version:
+            return
+        if value is not None:
+            value = (_snapshot(value[0]), _snapshot(value[1]))
+        self._entries.pop(user_id, None)
+        while len(self._entries) >= self.maxsize:
+            self._entries.pop(next(iter(self._entries)))
+        self._entries[user_id] = (time.monotonic() + self.ttl, value)
+
+    def invalidate(self, user_id: int) -> None:
+        self._version += 1
+        self._entries.pop(user_id, None)
+
+    def clear(self) -> None:
+        self._version += 1
+        self._entries.clear()
+
+    def has_pending(self, session: Any, user_id: int) -> bool:
+        """True if the session has uncommitted discount writes for this user."""
+        pending = session.info.get(_PENDING_INFO_KEY)
+        return bool(pending) and (user_id in pending or None in pending)
+
+    def invalidate_on_commit(self, session: Any,
+                             user_id: Optional[int] = None) -> None:
+        """
+        Drop the user's entry (all entries if user_id is None) now and again
+        when the session's transaction commits or rolls back.
+        """
+        session.info.setdefault(_PENDING_INFO_KEY, set()).add(user_id)
+        if user_id is None:
+            self.clear()
+        else:
+            self.invalidate(user_id)
+
+
+active_discount_cache = ActiveDiscountCache()
+
+
+@event.listens_for(Session, "after_commit")
+@event.listens_for(Session, "after_rollback")
+def _apply_pending_invalidations(session: Session) -> None:
+    pending = session.info.pop(_PENDING_INFO_KEY, None)
+    if not pending:
+        return
+    if None in pending:
+        active_discount_cache.clear()
+        return
+    for user_id in pending:
+        active_discount_cache.invalidate(user_id)
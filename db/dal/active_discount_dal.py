@@ -1,11 +1,13 @@
 import logging
-from typing import Optional, List
+from typing import Optional, List, Tuple
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from sqlalchemy import delete
+from sqlalchemy import delete, func, lambda_stmt
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from datetime import datetime, timezone
 
-from db.models import ActiveDiscount
+from db.models import ActiveDiscount, PromoCode
+from .active_discount_cache import MISS, active_discount_cache
 
 
 async def set_active_discount(
@@ -18,31 +20,40 @@ async def set_active_discount(
     """
     Set active discount for user.
     Returns None if user already has an active discount (enforce one-at-a-time rule).
+    An expired reservation is replaced in the same statement.
     """
-    now_utc = datetime.now(timezone.utc)
-
-    existing = await get_active_discount(session, user_id, include_expired=True)
-    if existing and existing.expires_at > now_utc:
-        logging.warning(
-            f"User {user_id} already has active discount (promo_code_id: {existing.promo_code_id}). "
-            f"Cannot activate new discount {promo_code_id}."
-        )
-        return None
-
-    if existing and existing.expires_at <= now_utc:
-        await clear_active_discount_if_expired(session, user_id, now=now_utc)
-
-    # Create new active discount
-    new_discount = ActiveDiscount(
+    insert_stmt = pg_insert(ActiveDiscount).values(
         user_id=user_id,
         promo_code_id=promo_code_id,
         discount_percentage=discount_percentage,
-        activated_at=now_utc,
+        activated_at=func.now(),
         expires_at=expires_at,
     )
-    session.add(new_discount)
-    await session.flush()
-    await session.refresh(new_discount)
+    stmt = (
+        insert_stmt.on_conflict_do_update(
+            index_elements=[ActiveDiscount.user_id],
+            set_={
+                "promo_code_id": insert_stmt.excluded.promo_code_id,
+                "discount_percentage": insert_stmt.excluded.discount_percentage,
+                "activated_at": insert_stmt.excluded.activated_at,
+                "expires_at": insert_stmt.excluded.expires_at,
+            },
+            where=ActiveDiscount.expires_at <= func.now(),
+        )
+        .returning(ActiveDiscount)
+    )
+    result = await session.execute(
+        stmt, execution_options={"populate_existing": True}
+    )
+    new_discount = result.scalar_one_or_none()
+    active_discount_cache.invalidate_on_commit(session, user_id)
+    if new_discount is None:
+        logging.warning(
+            f"User {user_id} already has active discount. "
+            f"Cannot activate new discount {promo_code_id}."
+        )
+        return None
+
     logging.info(
         f"Active discount set for user {user_id}: promo_code_id={promo_code_id}, "
         f"discount={discount_percentage}%"
@@ -50,18 +61,55 @@ async def set_active_discount(
     return new_discount
 
 
+async def _load_active_discount_with_promo(
+    session: AsyncSession,
+    user_id: int,
+) -> Optional[Tuple[ActiveDiscount, PromoCode]]:
+    """Load discount + promo pair regardless of expiry, served from cache when possible."""
+    # Our own uncommitted writes must neither be served from nor leak into the cache
+    use_cache = not active_discount_cache.has_pending(session, user_id)
+    if use_cache:
+        cached = active_discount_cache.get(user_id)
+        if cached is not MISS:
+            return cached
+
+    cache_version = active_discount_cache.version
+    stmt = lambda_stmt(
+        lambda: select(ActiveDiscount, PromoCode)
+        .join(PromoCode, ActiveDiscount.promo_code_id == PromoCode.promo_code_id)
+        .where(ActiveDiscount.user_id == user_id)
+    )
+    result = await session.execute(stmt)
+    discount_with_promo = result.tuples().one_or_none()
+    if use_cache:
+        active_discount_cache.set(user_id, discount_with_promo, cache_version)
+    return discount_with_promo
+
+
 async def get_active_discount(
     session: AsyncSession,
     user_id: int,
     include_expired: bool = False,
 ) -> Optional[ActiveDiscount]:
     """Get active discount for user if exists."""
-    now_utc = datetime.now(timezone.utc)
-    stmt = select(ActiveDiscount).where(ActiveDiscount.user_id == user_id)
-    if not include_expired:
-        stmt = stmt.where(ActiveDiscount.expires_at > now_utc)
-    result = await session.execute(stmt)
-    return result.scalar_one_or_none()
+    discount_with_promo = await get_active_discount_with_promo(
+        session, user_id, include_expired=include_expired
+    )
+    return discount_with_promo[0] if discount_with_promo else None
+
+
+async def get_active_discount_with_promo(
+    session: AsyncSession,
+    user_id: int,
+    include_expired: bool = False,
+) -> Optional[Tuple[ActiveDiscount, PromoCode]]:
+    """Get active discount for user together with its promo code in one query."""
+    discount_with_promo = await _load_active_discount_with_promo(session, user_id)
+    if discount_with_promo is None:
+        return None
+    if not include_expired and discount_with_promo[0].expires_at <= datetime.now(timezone.utc):
+        return None
+    return discount_with_promo
 
 
 async def clear_active_discount(
@@ -75,6 +123,7 @@ async def clear_active_discount(
     stmt = delete(ActiveDiscount).where(ActiveDiscount.user_id == user_id)
     result = await session.execute(stmt)
     await session.flush()
+    active_discount_cache.invalidate_on_commit(session, user_id)
     cleared = result.rowcount > 0
     if cleared:
         logging.info(f"Active discount cleared for user {user_id}")
@@ -96,6 +145,7 @@ async def clear_active_discount_if_expired(
     )
     result = await session.execute(stmt)
     await session.flush()
+    active_discount_cache.invalidate_on_commit(session, user_id)
     cleared = result.rowcount > 0
     if cleared:
         logging.info("Expired active discount cleared for user %s", user_id)
@@ -120,6 +170,7 @@ async def clear_active_discount_if_matches(
     stmt = delete(ActiveDiscount).where(*conditions)
     result = await session.execute(stmt)
     await session.flush()
+    active_discount_cache.invalidate_on_commit(session, user_id)
     cleared = result.rowcount > 0
     if cleared:
         logging.info(
@@ -157,6 +208,7 @@ async def clear_active_discounts_by_promo_code(
     stmt = delete(ActiveDiscount).where(ActiveDiscount.promo_code_id == promo_code_id)
     result = await session.execute(stmt)
     await session.flush()
+    active_discount_cache.invalidate_on_commit(session)
     count = result.rowcount
     if count > 0:
         logging.info(f"Cleared {count} active discount(s) for promo_code_id={promo_code_id}")
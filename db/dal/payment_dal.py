@@ -2,10 +2,11 @@ import logging
 from typing import Optional, List, Dict, Any
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from sqlalchemy import update, func, and_
+from sqlalchemy import update, func, and_, text
 from sqlalchemy.orm import selectinload
 
 from db.models import Payment
+from .active_discount_cache import active_discount_cache
 
 
 async def create_payment_record(session: AsyncSession,
@@ -315,6 +316,89 @@ async def update_payment_discount_info(
     return payment
 
 
+_CONSUME_DISCOUNT_SQL = text("""
+WITH pay AS (
+    SELECT payment_id, promo_code_id,
+           COALESCE(discount_applied, 0) <> 0 AS discount_applied
+    FROM payments
+    WHERE payment_id = :payment_id
+),
+eligible AS (
+    SELECT payment_id, promo_code_id
+    FROM pay
+    WHERE discount_applied AND promo_code_id IS NOT NULL
+),
+existing AS (
+    SELECT a.activation_id
+    FROM promo_code_activations a
+    JOIN eligible e ON a.promo_code_id = e.promo_code_id
+    WHERE a.user_id = :user_id
+),
+linked AS (
+    UPDATE promo_code_activations a
+    SET payment_id = e.payment_id
+    FROM eligible e
+    WHERE a.promo_code_id = e.promo_code_id
+      AND a.user_id = :user_id
+      AND a.payment_id IS NULL
+    RETURNING a.activation_id
+),
+created AS (
+    INSERT INTO promo_code_activations (promo_code_id, user_id, payment_id, activated_at)
+    SELECT e.promo_code_id, :user_id, e.payment_id, now()
+    FROM eligible e
+    WHERE NOT EXISTS (SELECT 1 FROM existing)
+    ON CONFLICT (promo_code_id, user_id) DO NOTHING
+    RETURNING activation_id
+),
+incremented AS (
+    UPDATE promo_codes p
+    SET current_activations = p.current_activations + 1
+    FROM eligible e
+    WHERE p.promo_code_id = e.promo_code_id
+      AND EXISTS (SELECT 1 FROM created)
+    RETURNING p.promo_code_id
+),
+reservation AS (
+    SELECT promo_code_id FROM active_discounts WHERE user_id = :user_id
+),
+cleared AS (
+    DELETE FROM active_discounts d
+    USING eligible e
+    WHERE d.user_id = :user_id AND d.promo_code_id = e.promo_code_id
+    RETURNING d.user_id
+)
+SELECT pay.promo_code_id,
+       pay.discount_applied,
+       EXISTS (SELECT 1 FROM existing) AS activation_existed,
+       EXISTS (SELECT 1 FROM linked) AS activation_linked,
+       EXISTS (SELECT 1 FROM created) AS activation_created,
+       EXISTS (SELECT 1 FROM incremented) AS usage_incremented,
+       (SELECT promo_code_id FROM reservation) AS reservation_promo_code_id,
+       EXISTS (SELECT 1 FROM cleared) AS reservation_cleared
+FROM pay
+""")
+
+
+async def consume_discount_atomic(
+        session: AsyncSession,
+        user_id: int,
+        payment_db_id: int) -> Optional[Dict[str, Any]]:
+    """
+    Record the discount promo activation for a paid payment in one statement:
+    link or create the activation, bump usage when it had to be created, and
+    clear the matching reservation. Returns None if the payment does not exist.
+    """
+    await session.flush()
+    result = await session.execute(
+        _CONSUME_DISCOUNT_SQL,
+        {"user_id": user_id, "payment_id": payment_db_id},
+    )
+    row = result.mappings().one_or_none()
+    active_discount_cache.invalidate_on_commit(session, user_id)
+    return dict(row) if row is not None else None
+
+
 async def get_financial_statistics(session: AsyncSession) -> Dict[str, Any]:
     """Get comprehensive financial statistics."""
     from datetime import datetime, timedelta
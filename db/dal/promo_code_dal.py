@@ -1,11 +1,12 @@
 import logging
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Tuple
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from sqlalchemy import update, func, and_, or_
-from datetime import datetime, timezone
+from sqlalchemy import update, delete, exists, func, and_, or_, lambda_stmt, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 
 from db.models import PromoCode, PromoCodeActivation, User, Payment
+from .active_discount_cache import active_discount_cache
 
 
 async def create_promo_code(session: AsyncSession,
@@ -13,7 +14,6 @@ async def create_promo_code(session: AsyncSession,
     new_promo = PromoCode(**promo_data)
     session.add(new_promo)
     await session.flush()
-    await session.refresh(new_promo)
     logging.info(
         f"Promo code '{new_promo.code}' created with ID {new_promo.promo_code_id}"
     )
@@ -27,48 +27,81 @@ async def get_promo_code_by_id(session: AsyncSession,
 
 async def get_promo_code_by_code(session: AsyncSession, code_str: str) -> Optional[PromoCode]:
     """Get promo code by code string (regardless of active status)"""
-    stmt = select(PromoCode).where(PromoCode.code == code_str.upper())
+    code_upper = code_str.upper()
+    stmt = lambda_stmt(
+        lambda: select(PromoCode).where(PromoCode.code == code_upper))
     result = await session.execute(stmt)
     return result.scalar_one_or_none()
 
 
 async def get_active_promo_code_by_code_str(
         session: AsyncSession, code_str: str) -> Optional[PromoCode]:
-    stmt = select(PromoCode).where(
-        PromoCode.code == code_str.upper(), PromoCode.is_active == True,
+    code_upper = code_str.upper()
+    stmt = lambda_stmt(lambda: select(PromoCode).where(
+        PromoCode.code == code_upper, PromoCode.is_active == True,
         PromoCode.current_activations < PromoCode.max_activations,
         or_(PromoCode.valid_until == None, PromoCode.valid_until
-            > datetime.now(timezone.utc)))
+            > func.now())))
     result = await session.execute(stmt)
     return result.scalar_one_or_none()
 
 
-async def get_active_bonus_promo_code_by_code_str(
+async def claim_active_bonus_promo(
         session: AsyncSession, code_str: str) -> Optional[PromoCode]:
-    """Get active bonus_days-type promo code by code string"""
-    stmt = select(PromoCode).where(
-        PromoCode.code == code_str.upper(),
-        PromoCode.promo_type == "bonus_days",
-        PromoCode.is_active == True,
-        PromoCode.current_activations < PromoCode.max_activations,
-        or_(PromoCode.valid_until == None, PromoCode.valid_until
-            > datetime.now(timezone.utc)))
-    result = await session.execute(stmt)
+    """
+    Atomically reserve one activation of an active bonus_days promo code.
+    Returns the updated promo code, or None if the code is missing, inactive,
+    expired or exhausted.
+    """
+    stmt = (
+        update(PromoCode)
+        .where(
+            PromoCode.code == code_str.upper(),
+            PromoCode.promo_type == "bonus_days",
+            PromoCode.is_active == True,
+            PromoCode.current_activations < PromoCode.max_activations,
+            or_(PromoCode.valid_until == None, PromoCode.valid_until
+                > func.now()))
+        .values(current_activations=PromoCode.current_activations + 1)
+        .returning(PromoCode)
+    )
+    result = await session.execute(
+        stmt,
+        execution_options={
+            "synchronize_session": False,
+            "populate_existing": True,
+        },
+    )
     return result.scalar_one_or_none()
 
 
-async def get_active_discount_promo_code_by_code_str(
-        session: AsyncSession, code_str: str) -> Optional[PromoCode]:
-    """Get active discount-type promo code by code string"""
-    stmt = select(PromoCode).where(
-        PromoCode.code == code_str.upper(),
+async def get_active_discount_promo_code_for_user(
+        session: AsyncSession, code_str: str,
+        user_id: int) -> Optional[Tuple[PromoCode, bool]]:
+    """
+    Get active discount-type promo code by code string together with a flag
+    telling whether the user has already activated it, in one query.
+    """
+    code_upper = code_str.upper()
+    stmt = lambda_stmt(lambda: select(
+        PromoCode,
+        select(PromoCodeActivation.activation_id).where(
+            PromoCodeActivation.promo_code_id == PromoCode.promo_code_id,
+            PromoCodeActivation.user_id == user_id).exists().label(
+                "already_activated"),
+    ).where(
+        PromoCode.code == code_upper,
         PromoCode.promo_type == "discount",
         PromoCode.is_active == True,
         PromoCode.current_activations < PromoCode.max_activations,
         or_(PromoCode.valid_until == None, PromoCode.valid_until
-            > datetime.now(timezone.utc)))
+            > func.now())))
     result = await session.execute(stmt)
-    return result.scalar_one_or_none()
+    row = result.tuples().one_or_none()
+    if row is None:
+        return None
+    promo, already_activated = row
+    return promo, bool(already_activated)
 
 
 async def get_all_active_promo_codes(session: AsyncSession,
@@ -77,7 +110,7 @@ async def get_all_active_promo_codes(session: AsyncSession,
     stmt = (select(PromoCode).where(
         PromoCode.is_active == True,
         or_(PromoCode.valid_until == None, PromoCode.valid_until
-            > datetime.now(timezone.utc))).order_by(
+            > func.now())).order_by(
                 PromoCode.created_at.desc()).limit(limit).offset(offset))
     result = await session.execute(stmt)
     return result.scalars().all()
@@ -100,6 +133,23 @@ async def get_promo_codes_count(session: AsyncSession) -> int:
     return result.scalar_one()
 
 
+async def get_promo_codes_count_estimate(session: AsyncSession,
+                                         exact_below: int = 10_000) -> int:
+    """
+    Get planner-estimated count of promo codes from pg_class (O(1)).
+    Falls back to the exact count when the table is small or never analyzed,
+    where the estimate is unreliable and count(*) is cheap anyway.
+    """
+    stmt = text(
+        "SELECT reltuples::BIGINT FROM pg_class WHERE oid = to_regclass(:table_name)"
+    )
+    result = await session.execute(stmt, {"table_name": PromoCode.__tablename__})
+    estimate = result.scalar_one_or_none()
+    if estimate is None or estimate < exact_below:
+        return await get_promo_codes_count(session)
+    return int(estimate)
+
+
 async def get_promo_activations_by_code_id(session: AsyncSession, promo_code_id: int, limit: Optional[int] = None, offset: int = 0) -> List[PromoCodeActivation]:
     """Get activation history for a specific promo code with optional pagination."""
     stmt = (select(PromoCodeActivation)
@@ -127,7 +177,7 @@ async def update_promo_code(session: AsyncSession, promo_id: int,
     for key, value in update_data.items():
         setattr(promo, key, value)
     await session.flush()
-    await session.refresh(promo)
+    active_discount_cache.invalidate_on_commit(session)
     return promo
 
 
@@ -146,9 +196,8 @@ async def delete_promo_code(session: AsyncSession, promo_id: int) -> Optional[Pr
     await session.execute(stmt)
 
     # 3. Delete related activations
-    activations = await get_promo_activations_by_code_id(session, promo_id)
-    for activation in activations:
-        await session.delete(activation)
+    stmt = delete(PromoCodeActivation).where(PromoCodeActivation.promo_code_id == promo_id)
+    await session.execute(stmt)
 
     # 4. Delete the promo code itself
     await session.delete(promo)
@@ -170,11 +219,18 @@ async def increment_promo_code_usage(
         update(PromoCode)
         .where(*conditions)
         .values(current_activations=PromoCode.current_activations + 1)
+        .returning(PromoCode)
     )
-    result = await session.execute(stmt)
-    if result.rowcount and result.rowcount > 0:
-        await session.flush()
-        return await get_promo_code_by_id(session, promo_code_id)
+    result = await session.execute(
+        stmt,
+        execution_options={
+            "synchronize_session": False,
+            "populate_existing": True,
+        },
+    )
+    updated_promo = result.scalar_one_or_none()
+    if updated_promo is not None:
+        return updated_promo
 
     promo = await get_promo_code_by_id(session, promo_code_id)
     if promo:
@@ -214,67 +270,49 @@ async def get_user_activation_for_promo(
     return result.scalar_one_or_none()
 
 
-async def record_promo_activation(
-        session: AsyncSession,
-        promo_code_id: int,
-        user_id: int,
-        payment_id: Optional[int] = None) -> Optional[PromoCodeActivation]:
-    existing_activation = await get_user_activation_for_promo(
-        session, promo_code_id, user_id)
-    if existing_activation:
-        logging.info(
-            f"User {user_id} has already activated promo code {promo_code_id}. Activation ID: {existing_activation.activation_id}"
-        )
-        return existing_activation
-
-    from .user_dal import get_user_by_id
-    user = await get_user_by_id(session, user_id)
-    promo = await get_promo_code_by_id(session, promo_code_id)
-    if not user or not promo:
-        logging.error(
-            f"Cannot record promo activation: User {user_id} or Promo {promo_code_id} not found."
-        )
-        return None
-
-    if payment_id:
-        from .payment_dal import get_payment_by_db_id
-        payment = await get_payment_by_db_id(session, payment_id)
-        if not payment:
-            logging.error(
-                f"Cannot record promo activation: Payment {payment_id} not found."
-            )
-            return None
-
-    activation_data = {
-        "promo_code_id": promo_code_id,
-        "user_id": user_id,
-        "payment_id": payment_id,
-        "activated_at": datetime.now(timezone.utc)
-    }
-    new_activation = PromoCodeActivation(**activation_data)
-    session.add(new_activation)
-    await session.flush()
-    await session.refresh(new_activation)
-    logging.info(
-        f"Promo code {promo_code_id} activated by user {user_id}. Activation ID: {new_activation.activation_id}"
-    )
-    return new_activation
+async def user_has_activated_promo(
+        session: AsyncSession, promo_code_id: int, user_id: int) -> bool:
+    stmt = select(
+        exists().where(
+            PromoCodeActivation.promo_code_id == promo_code_id,
+            PromoCodeActivation.user_id == user_id))
+    return bool(await session.scalar(stmt))
 
 
-async def set_activation_payment_id(
+async def record_promo_activation(
         session: AsyncSession,
         promo_code_id: int,
         user_id: int,
-        payment_id: int) -> bool:
+        payment_id: Optional[int] = None
+) -> Tuple[Optional[PromoCodeActivation], bool]:
+    """
+    Insert the activation unless the user already has one for this promo.
+    Returns (activation, created); on conflict the existing row is returned
+    with created=False.
+    """
     stmt = (
-        update(PromoCodeActivation)
-        .where(
-            PromoCodeActivation.promo_code_id == promo_code_id,
-            PromoCodeActivation.user_id == user_id,
-            PromoCodeActivation.payment_id == None,
+        pg_insert(PromoCodeActivation)
+        .values(
+            promo_code_id=promo_code_id,
+            user_id=user_id,
+            payment_id=payment_id,
+            activated_at=func.now(),
         )
-        .values(payment_id=payment_id)
+        .on_conflict_do_nothing(index_elements=["promo_code_id", "user_id"])
+        .returning(PromoCodeActivation)
     )
     result = await session.execute(stmt)
-    await session.flush()
-    return bool(result.rowcount and result.rowcount > 0)
+    new_activation = result.scalar_one_or_none()
+    if new_activation is None:
+        existing_activation = await get_user_activation_for_promo(
+            session, promo_code_id, user_id)
+        if existing_activation:
+            logging.info(
+                f"User {user_id} has already activated promo code {promo_code_id}. Activation ID: {existing_activation.activation_id}"
+            )
+        return existing_activation, False
+
+    logging.info(
+        f"Promo code {promo_code_id} activated by user {user_id}. Activation ID: {new_activation.activation_id}"
+    )
+    return new_activation, True
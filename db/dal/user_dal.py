@@ -115,8 +115,7 @@ async def create_user(session: AsyncSession, user_data: Dict[str, Any]) -> Tuple
     )
 
     result = await session.execute(stmt)
-    inserted_row = result.first()
-    created = inserted_row is not None
+    created = result.scalar_one_or_none() is not None
 
     # Fetch the user (inserted just now or pre-existing)
     user_id: int = user_data["user_id"]
@@ -34,7 +34,10 @@ def init_db_connection(settings: Settings) -> sessionmaker:
         async_engine = create_async_engine(
             settings.DATABASE_URL,
             echo=False,
+            pool_size=settings.DB_POOL_SIZE,
+            max_overflow=settings.DB_MAX_OVERFLOW,
             pool_pre_ping=True,
+            pool_recycle=settings.DB_POOL_RECYCLE_SECONDS,
         )
 
     local_async_session_factory = async_sessionmaker(
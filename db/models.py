@@ -1,4 +1,4 @@
-from sqlalchemy import create_engine, Column, Integer, String, Boolean, DateTime, Float, ForeignKey, UniqueConstraint, Text, BigInteger
+from sqlalchemy import create_engine, Column, Integer, String, Boolean, DateTime, Float, ForeignKey, UniqueConstraint, Index, Text, BigInteger, text
 from sqlalchemy.orm import relationship, DeclarativeBase
 from sqlalchemy.ext.asyncio import AsyncAttrs
 from sqlalchemy.sql import func
@@ -122,6 +122,8 @@ class Payment(Base):
     promo_code_used = relationship("PromoCode",
                                    back_populates="payments_where_used")
 
+    __table_args__ = (Index("idx_payments_promo_code_id", "promo_code_id"), )
+
 
 class UserBilling(Base):
     __tablename__ = "user_billing"
@@ -179,17 +181,26 @@ class PromoCode(Base):
 
     activations = relationship("PromoCodeActivation",
                                back_populates="promo_code",
-                               cascade="all, delete-orphan")
+                               cascade="all, delete-orphan",
+                               passive_deletes=True)
     payments_where_used = relationship("Payment",
                                        back_populates="promo_code_used")
 
+    # Fetch server defaults (created_at) via INSERT ... RETURNING on flush
+    __mapper_args__ = {"eager_defaults": True}
+
+    __table_args__ = (Index("idx_promo_codes_active_created_at",
+                            "created_at",
+                            postgresql_where=text("is_active")), )
+
 
 class PromoCodeActivation(Base):
     __tablename__ = "promo_code_activations"
 
     activation_id = Column(Integer, primary_key=True, autoincrement=True)
     promo_code_id = Column(Integer,
-                           ForeignKey("promo_codes.promo_code_id"),
+                           ForeignKey("promo_codes.promo_code_id",
+                                      ondelete="CASCADE"),
                            nullable=False)
     user_id = Column(BigInteger, ForeignKey("users.user_id"), nullable=False)
     activated_at = Column(DateTime(timezone=True), server_default=func.now())
@@ -227,6 +238,9 @@ class ActiveDiscount(Base):
     promo_code = relationship("PromoCode")
     user = relationship("User")
 
+    __table_args__ = (Index("idx_active_discounts_promo_code_id",
+                            "promo_code_id"), )
+
 
 class MessageLog(Base):
     __tablename__ = "message_logs"